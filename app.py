@@ -2,9 +2,12 @@ import io
 import re
 import os
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
+import plotly.io as pio
 import pycountry
 
 # ============================================================
@@ -13,14 +16,154 @@ import pycountry
 st.set_page_config(page_title="Roaming Usage Dashboard", layout="wide")
 st.title("📶 Roaming Data Usage by Country")
 
-MAPPING_PATH = "mapping/network_to_country.csv"
-PARTNER_MAPPING_PATH = "mapping/partner_to_country.csv"
+MAPPING_PATH = "mapping/network_to_country.parquet"
+PARTNER_MAPPING_PATH = "mapping/partner_to_country.parquet"
+
+# Seed files only: read once and converted to Parquet when the Parquet mapping does not exist
+# yet. After that the app reads and writes the (untracked) .parquet files, never these CSVs.
+MAPPING_CSV_PATH = "mapping/network_to_country.csv"
+PARTNER_MAPPING_CSV_PATH = "mapping/partner_to_country.csv"
+
+VALUE_COLS = ["Total Volume(KB)", "Total Duration(min)", "Total GPRS Amount(USD)", "Total Voice Amount(USD)"]
+
+_YEAR_RE = re.compile(r"(19\d{2}|20\d{2})")
+_NONALPHA_RE = re.compile(r"[^A-Za-z\s]")
+_ALPHA_WORD_RE = re.compile(r"[A-Za-z]{4}")
+_WHITESPACE_RE = re.compile(r"\s+")
+_DAILY_VOL_RE = re.compile(r"^volume\s*\(kb\)(\.\d+)?$", re.IGNORECASE)
+
+# ============================================================
+# Inference rules
+# ============================================================
+NETWORK_PREFIX_MAP = {
+    "ARG": "Argentina",
+    "AUS": "Australia",
+    "ESP": "Spain",
+    "GBR": "United Kingdom",
+    "HKG": "Hong Kong",
+    "HRV": "Croatia",
+    "IND": "India",
+    "IRL": "Ireland",
+    "ISR": "Israel",
+    "JPN": "Japan",
+    "KOR": "South Korea",
+    "KWT": "Kuwait",
+    "LBN": "Lebanon",
+    "LTU": "Lithuania",
+    "LUX": "Luxembourg",
+    "MAC": "Macau",
+    "MDV": "Maldives",
+    "MEX": "Mexico",
+    "MMR": "Myanmar",
+    "MYS": "Malaysia",
+    "NOR": "Norway",
+    "NPL": "Nepal",
+    "NZL": "New Zealand",
+    "OMN": "Oman",
+    "PAN": "Panama",
+    "POL": "Poland",
+    "PRI": "Puerto Rico",
+    "QAT": "Qatar",
+    "ROM": "Romania",
+    "RUS": "Russia",
+    "SAU": "Saudi Arabia",
+    "SVK": "Slovakia",
+    "SWE": "Sweden",
+    "THA": "Thailand",
+    "TUR": "Turkey",
+    "USA": "United States",
+
+    "AAZ": "Malta",
+    "AFG": "Afghanistan",
+    "ALB": "Albania",
+    "AUT": "Austria",
+    "BEL": "Belgium",
+    "BGD": "Bangladesh",
+    "BGR": "Bulgaria",
+    "BRA": "Brazil",
+    "CAN": "Canada",
+    "CHE": "Switzerland",
+    "CHN": "China",
+    "CZE": "Czech Republic",
+    "DEU": "Germany",
+    "DNK": "Denmark",
+    "EGY": "Egypt",
+    "EST": "Estonia",
+    "FIN": "Finland",
+    "FRA": "France",
+    "GHA": "Ghana",
+    "GRC": "Greece",
+    "HUN": "Hungary",
+    "IDN": "Indonesia",
+    "ITA": "Italy",
+    "LKA": "Sri Lanka",
+    "NLD": "Netherlands",
+    "PAK": "Pakistan",
+    "PHL": "Philippines",
+    "PRT": "Portugal",
+    "SGP": "Singapore",
+    "ZAF": "South Africa",
+
+    "LVA": "Latvia",
+    "BMU": "Bermuda",
+}
+
+PARTNER_RULES = {
+    "reliance jio": "India",
+    "jio infocomm": "India",
+    "bharti airtel": "India",
+    "airtel": "India",
+    "vodafone essar": "India",
+    "mtnl": "India",
+    "mahanagar telephone nigam": "India",
+
+    "tele2 latvia": "Latvia",
+    "tele 2 latvia": "Latvia",
+
+    "bermuda": "Bermuda",
+}
+
+# Lowercased name / official name / common name -> pycountry name, with the same
+# precedence pycountry.countries.lookup uses for its indexes.
+_COUNTRY_NAMES = {}
+for _field in ["name", "official_name", "common_name"]:
+    for _c in pycountry.countries:
+        _v = getattr(_c, _field, None)
+        if _v:
+            _COUNTRY_NAMES.setdefault(_v.lower(), _c.name)
+
+COUNTRY_NAME_FIXES = {
+    "USA": "United States",
+    "U.S.A": "United States",
+    "UK": "United Kingdom",
+    "Russia": "Russian Federation",
+    "South Korea": "Korea, Republic of",
+    "Viet Nam": "Vietnam",
+    "Iran": "Iran, Islamic Republic of",
+    "Syria": "Syrian Arab Republic",
+    "Bolivia": "Bolivia, Plurinational State of",
+    "Tanzania": "Tanzania, United Republic of",
+    "Laos": "Lao People's Democratic Republic",
+    "Moldova": "Moldova, Republic of",
+    "Brunei": "Brunei Darussalam",
+    "Hongkong": "Hong Kong",
+    "Hong Kong SAR": "Hong Kong",
+    "Macau": "Macao",
+}
+
+# Every value pycountry.countries.lookup matches on (lowercased) -> alpha_3
+_COUNTRY_ISO3 = {}
+for _field in ["alpha_2", "alpha_3", "name", "numeric", "official_name", "common_name"]:
+    for _c in pycountry.countries:
+        _v = getattr(_c, _field, None)
+        if _v:
+            _COUNTRY_ISO3.setdefault(_v.lower(), _c.alpha_3)
 
 # ============================================================
 # Helpers
 # ============================================================
 def safe_year_from_filename(name: str):
-    m = re.search(r"(19\d{2}|20\d{2})", str(name))
+    m = _YEAR_RE.search(str(name))
     return int(m.group(1)) if m else None
 
 
@@ -29,157 +172,25 @@ def country_to_iso3(country_name: str):
         return None
     name = str(country_name).strip()
 
-    fixes = {
-        "USA": "United States",
-        "U.S.A": "United States",
-        "UK": "United Kingdom",
-        "Russia": "Russian Federation",
-        "South Korea": "Korea, Republic of",
-        "Viet Nam": "Vietnam",
-        "Iran": "Iran, Islamic Republic of",
-        "Syria": "Syrian Arab Republic",
-        "Bolivia": "Bolivia, Plurinational State of",
-        "Tanzania": "Tanzania, United Republic of",
-        "Laos": "Lao People's Democratic Republic",
-        "Moldova": "Moldova, Republic of",
-        "Brunei": "Brunei Darussalam",
-        "Hongkong": "Hong Kong",
-        "Hong Kong SAR": "Hong Kong",
-        "Macau": "Macao",
-    }
-    name = fixes.get(name, name)
-
-    try:
-        c = pycountry.countries.lookup(name)
-        return c.alpha_3
-    except Exception:
-        return None
-
-
-def infer_country_from_network_id(network_id: str):
-    if pd.isna(network_id):
-        return None
-    nid = str(network_id).strip().upper()
-    prefix = nid[:3]
-
-    prefix_map = {
-        "ARG": "Argentina",
-        "AUS": "Australia",
-        "ESP": "Spain",
-        "GBR": "United Kingdom",
-        "HKG": "Hong Kong",
-        "HRV": "Croatia",
-        "IND": "India",
-        "IRL": "Ireland",
-        "ISR": "Israel",
-        "JPN": "Japan",
-        "KOR": "South Korea",
-        "KWT": "Kuwait",
-        "LBN": "Lebanon",
-        "LTU": "Lithuania",
-        "LUX": "Luxembourg",
-        "MAC": "Macau",
-        "MDV": "Maldives",
-        "MEX": "Mexico",
-        "MMR": "Myanmar",
-        "MYS": "Malaysia",
-        "NOR": "Norway",
-        "NPL": "Nepal",
-        "NZL": "New Zealand",
-        "OMN": "Oman",
-        "PAN": "Panama",
-        "POL": "Poland",
-        "PRI": "Puerto Rico",
-        "QAT": "Qatar",
-        "ROM": "Romania",
-        "RUS": "Russia",
-        "SAU": "Saudi Arabia",
-        "SVK": "Slovakia",
-        "SWE": "Sweden",
-        "THA": "Thailand",
-        "TUR": "Turkey",
-        "USA": "United States",
-
-        "AAZ": "Malta",
-        "AFG": "Afghanistan",
-        "ALB": "Albania",
-        "AUT": "Austria",
-        "BEL": "Belgium",
-        "BGD": "Bangladesh",
-        "BGR": "Bulgaria",
-        "BRA": "Brazil",
-        "CAN": "Canada",
-        "CHE": "Switzerland",
-        "CHN": "China",
-        "CZE": "Czech Republic",
-        "DEU": "Germany",
-        "DNK": "Denmark",
-        "EGY": "Egypt",
-        "EST": "Estonia",
-        "FIN": "Finland",
-        "FRA": "France",
-        "GHA": "Ghana",
-        "GRC": "Greece",
-        "HUN": "Hungary",
-        "IDN": "Indonesia",
-        "ITA": "Italy",
-        "LKA": "Sri Lanka",
-        "NLD": "Netherlands",
-        "PAK": "Pakistan",
-        "PHL": "Philippines",
-        "PRT": "Portugal",
-        "SGP": "Singapore",
-        "ZAF": "South Africa",
-
-        "LVA": "Latvia",
-        "BMU": "Bermuda",
-    }
-    return prefix_map.get(prefix)
-
-
-def infer_country_from_partner(partner_name: str):
-    if pd.isna(partner_name):
-        return None
-    name = str(partner_name).strip().lower()
-
-    rules = {
-        "reliance jio": "India",
-        "jio infocomm": "India",
-        "bharti airtel": "India",
-        "airtel": "India",
-        "vodafone essar": "India",
-        "mtnl": "India",
-        "mahanagar telephone nigam": "India",
-
-        "tele2 latvia": "Latvia",
-        "tele 2 latvia": "Latvia",
-
-        "bermuda": "Bermuda",
-    }
-
-    for k, v in rules.items():
-        if k in name:
-            return v
-    return None
+    name = COUNTRY_NAME_FIXES.get(name, name)
+    return _COUNTRY_ISO3.get(name.lower())
 
 
 def detect_country_from_partner_text(partner_name: str):
     if pd.isna(partner_name):
         return None
 
-    txt = re.sub(r"[^A-Za-z\s]", " ", str(partner_name)).strip()
+    txt = _NONALPHA_RE.sub(" ", str(partner_name)).strip()
     if not txt:
         return None
 
     words = [w for w in txt.split() if len(w) >= 4]
     for n in [4, 3, 2, 1]:
         for i in range(0, len(words) - n + 1):
-            phrase = " ".join(words[i : i + n])
-            try:
-                c = pycountry.countries.lookup(phrase)
-                return c.name
-            except Exception:
-                pass
+            phrase = " ".join(words[i : i + n]).lower()
+            hit = _COUNTRY_NAMES.get(phrase)
+            if hit:
+                return hit
     return None
 
 
@@ -191,7 +202,7 @@ def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
     rename_map = {}
 
     def norm(s: str) -> str:
-        return re.sub(r"\s+", "", str(s).strip().lower())
+        return _WHITESPACE_RE.sub("", str(s).strip().lower())
 
     total_volume_col = None
     total_gprs_col = None
@@ -199,7 +210,6 @@ def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
     total_duration_col = None
 
     daily_volume_cols = []
-    daily_vol_regex = re.compile(r"^volume\s*\(kb\)(\.\d+)?$", re.IGNORECASE)
 
     for c in df.columns:
         c_clean = str(c).strip()
@@ -232,7 +242,7 @@ def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
             total_voice_col = c
             continue
 
-        if daily_vol_regex.match(c_clean):
+        if _DAILY_VOL_RE.match(c_clean):
             daily_volume_cols.append(c)
             continue
 
@@ -268,29 +278,56 @@ def standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
 # ============================================================
 # Mapping load/save
 # ============================================================
-def load_mapping():
-    os.makedirs(os.path.dirname(MAPPING_PATH), exist_ok=True)
-    if not os.path.exists(MAPPING_PATH) or os.path.getsize(MAPPING_PATH) == 0:
-        pd.DataFrame({"Network ID": [], "Country": []}).to_csv(MAPPING_PATH, index=False)
+def clean_mapping(m: pd.DataFrame, key_col: str) -> pd.DataFrame:
+    m = m[[key_col, "Country"]].astype("string")
+    m[key_col] = m[key_col].str.strip()
+    m["Country"] = m["Country"].fillna("").str.strip()
+    m.loc[m["Country"].str.lower().isin(["none", "nan"]), "Country"] = ""
+    return m
 
-    m = pd.read_csv(MAPPING_PATH)
-    if "Network ID" not in m.columns or "Country" not in m.columns:
-        st.error("Mapping file must have columns: Network ID, Country")
+
+def read_mapping_csv(path: str, key_col: str, label: str) -> pd.DataFrame:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return pd.DataFrame({key_col: pd.Series(dtype="string"), "Country": pd.Series(dtype="string")})
+
+    m = pd.read_csv(path, dtype="string")
+    if key_col not in m.columns or "Country" not in m.columns:
+        st.error(f"{label} must have columns: {key_col}, Country")
         st.stop()
+    return clean_mapping(m, key_col)
 
-    m["Network ID"] = m["Network ID"].astype(str).str.strip()
-    m["Country"] = m["Country"].astype(str).fillna("").str.strip()
-    m.loc[m["Country"].str.lower().isin(["none", "nan"]), "Country"] = ""
+
+def read_mapping_parquet(path: str, key_col: str):
+    # An empty or unreadable file (e.g. an interrupted write) counts as missing
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        return clean_mapping(pd.read_parquet(path), key_col)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_mapping_parquet(m: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    m.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+@st.cache_data(show_spinner=False)
+def load_mapping():
+    m = read_mapping_parquet(MAPPING_PATH, "Network ID")
+    if m is None:
+        m = read_mapping_csv(MAPPING_CSV_PATH, "Network ID", "Mapping file")
+        write_mapping_parquet(m, MAPPING_PATH)
     return m
 
 
-def save_new_mappings_to_csv(mapping_df: pd.DataFrame, new_pairs_df: pd.DataFrame):
+def save_new_mappings(mapping_df: pd.DataFrame, new_pairs_df: pd.DataFrame):
     if new_pairs_df.empty:
         return mapping_df
 
-    new_pairs_df = new_pairs_df.copy()
-    new_pairs_df["Network ID"] = new_pairs_df["Network ID"].astype(str).str.strip()
-    new_pairs_df["Country"] = new_pairs_df["Country"].astype(str).str.strip()
+    new_pairs_df = new_pairs_df.dropna(subset=["Network ID", "Country"])
     new_pairs_df = new_pairs_df[(new_pairs_df["Network ID"] != "") & (new_pairs_df["Country"] != "")]
     if new_pairs_df.empty:
         return mapping_df
@@ -301,34 +338,31 @@ def save_new_mappings_to_csv(mapping_df: pd.DataFrame, new_pairs_df: pd.DataFram
     )
     combined = combined.drop_duplicates(subset=["Network ID"], keep="last").sort_values("Network ID")
 
-    os.makedirs(os.path.dirname(MAPPING_PATH), exist_ok=True)
-    combined.to_csv(MAPPING_PATH, index=False)
+    write_mapping_parquet(combined, MAPPING_PATH)
+    load_mapping.clear()
     return combined
 
 
+@st.cache_data(show_spinner=False)
 def load_partner_mapping():
-    os.makedirs(os.path.dirname(PARTNER_MAPPING_PATH), exist_ok=True)
-    if not os.path.exists(PARTNER_MAPPING_PATH) or os.path.getsize(PARTNER_MAPPING_PATH) == 0:
-        pd.DataFrame({"Partner Name": [], "Country": []}).to_csv(PARTNER_MAPPING_PATH, index=False)
+    pm = read_mapping_parquet(PARTNER_MAPPING_PATH, "Partner Name")
+    if pm is None:
+        pm = read_mapping_csv(PARTNER_MAPPING_CSV_PATH, "Partner Name", "Partner mapping file")
+        write_mapping_parquet(pm, PARTNER_MAPPING_PATH)
+    return pm
 
-    pm = pd.read_csv(PARTNER_MAPPING_PATH)
-    if "Partner Name" not in pm.columns or "Country" not in pm.columns:
-        st.error("Partner mapping file must have columns: Partner Name, Country")
-        st.stop()
 
-    pm["Partner Name"] = pm["Partner Name"].astype(str).str.strip()
-    pm["Country"] = pm["Country"].astype(str).fillna("").str.strip()
-    pm.loc[pm["Country"].str.lower().isin(["none", "nan"]), "Country"] = ""
-    return pm
+@st.cache_data(show_spinner=False)
+def load_partner_lookup():
+    pm = load_partner_mapping()
+    return dict(zip(pm["Partner Name"].str.lower().str.strip(), pm["Country"]))
 
 
 def save_partner_mappings(pm_df: pd.DataFrame, new_df: pd.DataFrame):
     if new_df.empty:
         return pm_df
 
-    new_df = new_df.copy()
-    new_df["Partner Name"] = new_df["Partner Name"].astype(str).str.strip()
-    new_df["Country"] = new_df["Country"].astype(str).str.strip()
+    new_df = new_df.dropna(subset=["Partner Name", "Country"])
     new_df = new_df[(new_df["Partner Name"] != "") & (new_df["Country"] != "")]
     if new_df.empty:
         return pm_df
@@ -336,25 +370,25 @@ def save_partner_mappings(pm_df: pd.DataFrame, new_df: pd.DataFrame):
     combined = pd.concat([pm_df[["Partner Name", "Country"]], new_df[["Partner Name", "Country"]]], ignore_index=True)
     combined = combined.drop_duplicates(subset=["Partner Name"], keep="last").sort_values("Partner Name")
 
-    os.makedirs(os.path.dirname(PARTNER_MAPPING_PATH), exist_ok=True)
-    combined.to_csv(PARTNER_MAPPING_PATH, index=False)
+    write_mapping_parquet(combined, PARTNER_MAPPING_PATH)
+    load_partner_mapping.clear()
+    load_partner_lookup.clear()
     return combined
 
 
 # ============================================================
 # Workbook parsing
 # ============================================================
+@st.cache_data(show_spinner=False)
 def parse_workbook(file_bytes: bytes, filename: str):
     year = safe_year_from_filename(filename)
-    xls = pd.ExcelFile(io.BytesIO(file_bytes), engine="openpyxl")
-    rows = []
+    xls = pd.ExcelFile(io.BytesIO(file_bytes), engine="calamine")
+    parts = []
 
-    for sheet in xls.sheet_names:
-        s = sheet.strip().lower()
-        if s in ["total", "sheet1"]:
-            continue
+    month_sheets = [sheet for sheet in xls.sheet_names if sheet.strip().lower() not in ["total", "sheet1"]]
+    sheets = pd.read_excel(xls, sheet_name=month_sheets, skiprows=1) if month_sheets else {}
 
-        df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet, skiprows=1, engine="openpyxl")
+    for sheet, df in sheets.items():
         df = standardize_columns(df)
 
         needed = [
@@ -365,37 +399,37 @@ def parse_workbook(file_bytes: bytes, filename: str):
         if any(col not in df.columns for col in needed):
             continue
 
-        partner = df["Partner Name"].astype("string").str.strip().fillna("")
-        network = df["Network ID"].astype("string").str.strip().fillna("")
+        df["Partner Name"] = df["Partner Name"].astype("string").str.strip().fillna("")
+        df["Network ID"] = df["Network ID"].astype("string").str.strip().fillna("")
 
-        df = df[
-            (partner != "") &
-            (network != "") &
-            (~partner.str.lower().isin(["total", "grand total"])) &
-            (~network.str.lower().isin(["total", "grand total"]))
-        ].copy()
+        keep = (
+            (df["Partner Name"] != "") &
+            (df["Network ID"] != "") &
+            (~df["Partner Name"].str.lower().isin(["total", "grand total"])) &
+            (~df["Network ID"].str.lower().isin(["total", "grand total"]))
+        )
+        df = df.loc[keep, needed]
 
-        for col in ["Total Volume(KB)", "Total Duration(min)", "Total GPRS Amount(USD)", "Total Voice Amount(USD)"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+        for col in VALUE_COLS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("float64")
 
         df["Year"] = year
         df["Month"] = sheet
-        rows.append(df[needed + ["Year", "Month"]])
+        df["SourceFile"] = filename
+        parts.append(df)
 
-    if not rows:
-        return pd.DataFrame(columns=[
-            "Partner Name", "Network ID",
-            "Total Volume(KB)", "Total Duration(min)",
-            "Total GPRS Amount(USD)", "Total Voice Amount(USD)",
-            "Year", "Month"
-        ])
-    return pd.concat(rows, ignore_index=True)
+    return parts
 
 
 def has_kaleido() -> bool:
     return importlib.util.find_spec("kaleido") is not None
 
 
+@st.cache_data(show_spinner=False)
+def fig_to_png(fig_json: str, scale: int = 3) -> bytes:
+    return pio.from_json(fig_json).to_image(format="png", scale=scale)
+
+
 # ============================================================
 # UI - Sidebar
 # ============================================================
@@ -409,6 +443,7 @@ uploaded_files = st.sidebar.file_uploader(
 
 mapping = load_mapping()
 partner_map = load_partner_mapping()
+pm_dict = load_partner_lookup()
 
 if not uploaded_files:
     st.warning("Upload one or more Excel files to begin.")
@@ -417,13 +452,12 @@ if not uploaded_files:
 # ============================================================
 # Parse
 # ============================================================
-all_data = []
-for uf in uploaded_files:
-    part = parse_workbook(uf.getvalue(), uf.name)
-    part["SourceFile"] = uf.name
-    all_data.append(part)
+all_parts = []
+with ThreadPoolExecutor(max_workers=min(8, len(uploaded_files))) as ex:
+    for parts in ex.map(parse_workbook, [uf.getvalue() for uf in uploaded_files], [uf.name for uf in uploaded_files]):
+        all_parts.extend(parts)
 
-raw_all = pd.concat(all_data, ignore_index=True)
+raw_all = pd.concat(all_parts, ignore_index=True) if all_parts else pd.DataFrame()
 if raw_all.empty:
     st.error("No usable data found. Check sheet names/headers.")
     st.stop()
@@ -431,60 +465,56 @@ if raw_all.empty:
 # ============================================================
 # Merge mapping + inference chain
 # ============================================================
-raw_all["Network ID"] = raw_all["Network ID"].astype(str).str.strip()
-df = raw_all.merge(mapping[["Network ID", "Country"]], on="Network ID", how="left")
-
-pm_dict = dict(zip(
-    partner_map["Partner Name"].astype(str).str.lower(),
-    partner_map["Country"].astype(str)
-))
-
-def infer_chain(row):
-    c = row.get("Country", "")
-    if pd.notna(c) and str(c).strip() != "":
-        return str(c).strip()
-
-    pname = str(row.get("Partner Name", "")).strip()
-    nid = str(row.get("Network ID", "")).strip()
-
-    if pname:
-        c_pm = pm_dict.get(pname.lower(), "")
-        if c_pm:
-            return c_pm
-
-    c2 = infer_country_from_partner(pname)
-    if c2:
-        return c2
-
-    c3 = detect_country_from_partner_text(pname)
-    if c3:
-        return c3
-
-    return infer_country_from_network_id(nid)
-
-df["Country_inferred"] = df.apply(infer_chain, axis=1)
-
+net_to_country = dict(zip(mapping["Network ID"], mapping["Country"]))
+df = raw_all
+df["Country"] = df["Network ID"].map(net_to_country)
+
+# Fill step by step over whole columns, same precedence as the old per-row chain:
+# mapping CSV -> partner mapping -> partner rules -> partner text -> network prefix
+pl = df["Partner Name"].str.lower()
+
+inferred = df["Country"].astype("string").str.strip()
+inferred = inferred.where(inferred != "")
+inferred = inferred.fillna(pl.map(pm_dict).replace("", pd.NA))
+# One substring pass per rule over the still-missing names only. Going in reverse dict order
+# lets earlier rules overwrite later ones, so the first rule in PARTNER_RULES wins.
+rule_names = pl[inferred.isna()]
+rule_hits = pd.Series(pd.NA, index=rule_names.index, dtype="string")
+for k, v in reversed(PARTNER_RULES.items()):
+    rule_hits = rule_hits.mask(rule_names.str.contains(k, regex=False), v)
+inferred = inferred.fillna(rule_hits)
+
+# detect_country_from_partner_text only looks at words of 4+ letters; skip names without one
+needs_text_scan = inferred.isna() & df["Partner Name"].str.contains(_ALPHA_WORD_RE)
+inferred = inferred.fillna(df.loc[needs_text_scan, "Partner Name"].map(detect_country_from_partner_text))
+
+network_prefix = df["Network ID"].str.upper().str[:3]
+inferred = inferred.fillna(network_prefix.map(NETWORK_PREFIX_MAP))
+
+df["Country_inferred"] = inferred
 df["Country_inferred"] = df["Country_inferred"].where(df["Country_inferred"].notna(), "")
 df["Country_inferred"] = df["Country_inferred"].astype("string").str.strip().fillna("")
 df.loc[df["Country_inferred"].str.lower().isin(["none", "nan"]), "Country_inferred"] = ""
 
 # Auto-save inferred mappings (network)
-new_pairs = df[["Network ID", "Country_inferred"]].rename(columns={"Country_inferred": "Country"}).drop_duplicates()
-mapped_set = set(mapping["Network ID"].astype(str).str.strip().tolist())
-new_pairs = new_pairs[~new_pairs["Network ID"].astype(str).str.strip().isin(mapped_set)]
-new_pairs = new_pairs[new_pairs["Country"].astype(str).str.strip() != ""]
+# "Country" still holds the mapping lookup here: NaN exactly when the Network ID is not in the CSV
+unmapped = df["Country"].isna() & (df["Country_inferred"] != "")
+new_pairs = (
+    df.loc[unmapped, ["Network ID", "Country_inferred"]]
+    .rename(columns={"Country_inferred": "Country"})
+    .drop_duplicates()
+)
 if not new_pairs.empty:
-    mapping = save_new_mappings_to_csv(mapping, new_pairs)
+    mapping = save_new_mappings(mapping, new_pairs)
 
 # Auto-save inferred mappings (partner)
 new_partner_pairs = (
-    df[df["Country_inferred"].astype(str).str.strip() != ""]
+    df[df["Country_inferred"] != ""]
     [["Partner Name", "Country_inferred"]]
     .rename(columns={"Country_inferred": "Country"})
     .drop_duplicates()
 )
-existing_pm = set(partner_map["Partner Name"].astype(str).str.lower())
-new_partner_pairs = new_partner_pairs[~new_partner_pairs["Partner Name"].astype(str).str.lower().isin(existing_pm)]
+new_partner_pairs = new_partner_pairs[~new_partner_pairs["Partner Name"].str.lower().isin(pm_dict.keys())]
 if not new_partner_pairs.empty:
     partner_map = save_partner_mappings(partner_map, new_partner_pairs)
 
@@ -519,25 +549,19 @@ if not missing_ids.empty:
         )
 
         if st.button("✅ Save mappings", type="primary"):
+            # Network ID / Partner Name are read-only here; only the typed Country needs cleaning
             to_save = edited.copy()
-            to_save["Network ID"] = to_save["Network ID"].astype(str).str.strip()
-            to_save["Country"] = to_save["Country"].astype(str).str.strip()
-            to_save = to_save[(to_save["Network ID"] != "") & (to_save["Country"] != "")]
+            to_save["Country"] = to_save["Country"].fillna("").astype(str).str.strip()
+            to_save = to_save[to_save["Country"] != ""]
 
             if to_save.empty:
                 st.error("Please fill at least one Country before saving.")
             else:
-                mapping = save_new_mappings_to_csv(mapping, to_save[["Network ID", "Country"]])
-
-                p_save = edited.copy()
-                p_save["Partner Name"] = p_save["Partner Name"].astype(str).str.strip()
-                p_save["Country"] = p_save["Country"].astype(str).str.strip()
-                p_save = p_save[(p_save["Partner Name"] != "") & (p_save["Country"] != "")]
-                if not p_save.empty:
-                    partner_map = save_partner_mappings(
-                        partner_map,
-                        p_save[["Partner Name", "Country"]].drop_duplicates()
-                    )
+                mapping = save_new_mappings(mapping, to_save[["Network ID", "Country"]])
+                partner_map = save_partner_mappings(
+                    partner_map,
+                    to_save[["Partner Name", "Country"]].drop_duplicates()
+                )
 
                 st.success(f"Saved {to_save.shape[0]} mapping(s). Refreshing…")
                 st.rerun()
@@ -545,19 +569,21 @@ if not missing_ids.empty:
 # ============================================================
 # Aggregate
 # ============================================================
-df_ok = df[df["Country"] != ""].copy()
-
-country_usage = (
-    df_ok.groupby(["Year", "Country"], as_index=False)
-    .agg({
-        "Total Volume(KB)": "sum",
-        "Total Duration(min)": "sum",
-        "Total GPRS Amount(USD)": "sum",
-        "Total Voice Amount(USD)": "sum"
-    })
-)
+df_ok = df.loc[df["Country"] != "", ["Year", "Country"] + VALUE_COLS].copy()
+df_ok["Country"] = df_ok["Country"].astype("category")
+
+# Grouped reductions stride badly over non C-contiguous buffers
+for col in VALUE_COLS:
+    values = df_ok[col].to_numpy()
+    if not values.flags.c_contiguous:
+        df_ok[col] = np.ascontiguousarray(values)
 
-country_usage["ISO3"] = country_usage["Country"].apply(country_to_iso3)
+country_usage = df_ok.groupby(["Year", "Country"], observed=True, sort=False, as_index=False)[VALUE_COLS].sum()
+
+# Resolve each distinct country once, then broadcast back over the (Year, Country) rows
+countries = country_usage["Country"].drop_duplicates()
+iso_map = dict(zip(countries, countries.map(country_to_iso3)))
+country_usage["ISO3"] = country_usage["Country"].map(iso_map)
 
 # ============================================================
 # Controls
@@ -630,15 +656,12 @@ st.subheader("⬇️ Download Charts")
 
 safe_metric = re.sub(r"[^A-Za-z0-9_]+", "_", str(metric)).strip("_")
 
-bar_html = fig_bar.to_html(full_html=True, include_plotlyjs="cdn").encode("utf-8")
-map_html = fig_map.to_html(full_html=True, include_plotlyjs="cdn").encode("utf-8")
-
 c1, c2, c3, c4 = st.columns(4)
 
 with c1:
     st.download_button(
         "📊 Bar (HTML)",
-        data=bar_html,
+        data=lambda: fig_bar.to_html(full_html=True, include_plotlyjs="cdn").encode("utf-8"),
         file_name=f"bar_{safe_metric}_{year_selected}.html",
         mime="text/html",
         key="dl_bar_html",
@@ -647,20 +670,17 @@ with c1:
 with c2:
     st.download_button(
         "🗺️ Map (HTML)",
-        data=map_html,
+        data=lambda: fig_map.to_html(full_html=True, include_plotlyjs="cdn").encode("utf-8"),
         file_name=f"map_{safe_metric}_{year_selected}.html",
         mime="text/html",
         key="dl_map_html",
     )
 
 if has_kaleido():
-    bar_png = fig_bar.to_image(format="png", scale=3)
-    map_png = fig_map.to_image(format="png", scale=3)
-
     with c3:
         st.download_button(
             "📊 Bar (PNG)",
-            data=bar_png,
+            data=lambda: fig_to_png(fig_bar.to_json(), 3),
             file_name=f"bar_{safe_metric}_{year_selected}.png",
             mime="image/png",
             key="dl_bar_png",
@@ -669,7 +689,7 @@ if has_kaleido():
     with c4:
         st.download_button(
             "🗺️ Map (PNG)",
-            data=map_png,
+            data=lambda: fig_to_png(fig_map.to_json(), 3),
             file_name=f"map_{safe_metric}_{year_selected}.png",
             mime="image/png",
             key="dl_map_png",